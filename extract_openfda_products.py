@@ -1,14 +1,26 @@
-import ijson
 import csv
+import json
+import re
+import sqlite3
 import sys
 import os
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# The C yajl2 backend is 10-50x faster than ijson's pure-Python parser on the full dataset
+try:
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    import ijson
+    print("WARN: ijson C backend (yajl2_c) unavailable, parsing will be slow. "
+          "Install libyajl2 and reinstall ijson for a large speedup.", file=sys.stderr)
 
 # Import resolution logic from existing script
 # Ensure current directory is in path to find resolve_sponsor module
 sys.path.append(os.getcwd())
 try:
-    from resolve_sponsor import find_company_by_name, enrich_company_content
+    from resolve_sponsor import find_company_by_name, find_companies_by_names, enrich_companies_bulk, RESOLVE_WORKERS, LookupUnavailable
 except ImportError:
     print("Error: Could not import resolve_sponsor.py. Make sure you are running this from the correct directory.")
     sys.exit(1)
@@ -16,61 +28,34 @@ except ImportError:
 INPUT_FILE = r"data/drug-drugsfda-0001-of-0001.json"
 OUTPUT_FILE = "products.csv"
 
-def load_and_group_products(filepath):
+# Sponsor names matched per batched label query
+NAME_BATCH_SIZE = 64
+
+# Persistent cache of sponsor resolutions across runs
+SPONSOR_CACHE_FILE = "sponsor_cache.db"
+SPONSOR_CACHE_TTL = 30 * 24 * 3600 # 30 days
+
+# Rows buffered per writerows() call and output file buffer size
+ROW_BATCH_SIZE = 4096
+WRITE_BUFFER_SIZE = 1 << 20
+
+def _iter_items(filepath, prefix):
     """
-    Reads OpenFDA JSON stream and groups products by sponsor.
-    Returns: dict { "Sponsor Name": [List of Product Dicts] }
+    Streams items under `prefix` from the OpenFDA JSON file with progress output.
+    Only one item is materialized at a time.
     """
     print(f"Reading OpenFDA data from {filepath}...")
-    sponsor_map = defaultdict(list)
     
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            # Stream 'results.item' - each item is an application record
-            objects = ijson.items(f, 'results.item')
-            
+        with open(filepath, 'rb') as f:
             count = 0
-            for record in objects:
+            for item in ijson.items(f, prefix):
                 count += 1
                 if count % 1000 == 0:
                     print(f"Processed {count} records...", end='\r')
-                    
-                sponsor = record.get("sponsor_name", "UNKNOWN")
-                products = record.get("products", [])
-                openfda = record.get("openfda", {})
-                
-                # Sometimes openfda block has better brand names
-                fda_brand_names = openfda.get("brand_name", [])
+                yield item
                 
-                # Extract RxCUI from openfda block (list of strings)
-                rxcui_list = openfda.get("rxcui", [])
-                rxcui_str = "; ".join(rxcui_list) if rxcui_list else ""
-                
-                for i, prod in enumerate(products):
-                    # Flatten product info
-                    brand_name = prod.get("brand_name", "Unknown")
-                    
-                    # If brand name is missing or generic, try to use openfda enrichment
-                    if (not brand_name or brand_name == "Unknown") and i < len(fda_brand_names):
-                        brand_name = fda_brand_names[i]
-                    
-                    # Separate Active Ingredients Name and Strength
-                    ingredients = prod.get("active_ingredients", [])
-                    ai_names = "; ".join([ai.get("name", "") for ai in ingredients])
-                    ai_strengths = "; ".join([ai.get("strength", "") for ai in ingredients])
-                    
-                    product_data = {
-                        "product_name": brand_name,
-                        "active_ingredients_name": ai_names,
-                        "active_ingredients_strength": ai_strengths,
-                        "rxcui": rxcui_str,
-                        "marketing_status": prod.get("marketing_status", "Unknown"),
-                        "dosage_form": prod.get("dosage_form", "Unknown")
-                    }
-                    sponsor_map[sponsor].append(product_data)
-                    
             print(f"\nFinished reading {count} records.")
-            return sponsor_map
             
     except FileNotFoundError:
         print(f"Error: File not found at {filepath}")
@@ -79,6 +64,151 @@ def load_and_group_products(filepath):
         print(f"Error reading JSON: {e}")
         sys.exit(1)
 
+def iter_sponsor_names(filepath):
+    """
+    Pass 1: yields the sponsor name of every application record.
+    Records without a sponsor_name yield "UNKNOWN".
+    """
+    for record in _iter_items(filepath, 'results.item'):
+        yield record.get("sponsor_name", "UNKNOWN")
+
+# Shared read-only defaults so missing keys don't allocate a fresh container per record
+_EMPTY = {}
+_NO_ITEMS = ()
+
+def iter_products(filepath):
+    """
+    Pass 2: streams flattened products from the OpenFDA JSON file.
+    Yields (sponsor, (product_name, ai_names, ai_strengths, rxcui, marketing_status, dosage_form)).
+    """
+    join = "; ".join
+    
+    # Stream 'results.item' - each item is an application record
+    for record in _iter_items(filepath, 'results.item'):
+        sponsor = record.get("sponsor_name", "UNKNOWN")
+        openfda = record.get("openfda", _EMPTY)
+        
+        # Sometimes openfda block has better brand names
+        fda_brand_names = openfda.get("brand_name", _NO_ITEMS)
+        
+        # Extract RxCUI from openfda block (list of strings)
+        rxcui_str = join(openfda.get("rxcui") or _NO_ITEMS)
+        
+        for i, prod in enumerate(record.get("products", _NO_ITEMS)):
+            # Flatten product info
+            brand_name = prod.get("brand_name", "Unknown")
+            
+            # If brand name is missing or generic, try to use openfda enrichment
+            if (not brand_name or brand_name == "Unknown") and i < len(fda_brand_names):
+                brand_name = fda_brand_names[i]
+            
+            # Separate Active Ingredients Name and Strength
+            # (single pass over the ingredients for both columns)
+            names, strengths = [], []
+            for ai in prod.get("active_ingredients", _NO_ITEMS):
+                names.append(ai.get("name", ""))
+                strengths.append(ai.get("strength", ""))
+            
+            yield sponsor, (
+                brand_name,
+                join(names),
+                join(strengths),
+                rxcui_str,
+                prod.get("marketing_status", "Unknown"),
+                prod.get("dosage_form", "Unknown")
+            )
+
+def open_sponsor_cache(path=SPONSOR_CACHE_FILE):
+    """
+    Opens (or creates) the SQLite cache of sponsor resolutions.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS sponsors (key TEXT PRIMARY KEY, json BLOB, fetched_at INT)"
+    )
+    return conn
+
+def canonical_sponsor(sponsor):
+    """
+    Canonical form of a sponsor name so that variants differing only in case,
+    whitespace or trailing punctuation ("Pfizer Inc", "PFIZER  INC.") resolve once.
+    """
+    return re.sub(r"\s+", " ", sponsor.strip().upper()).rstrip(".,")
+
+def _cache_key(sponsor):
+    return canonical_sponsor(sponsor)
+
+def cache_get(conn, sponsor, ttl=SPONSOR_CACHE_TTL):
+    """
+    Returns the cached resolution dict for a sponsor, or None if missing/expired.
+    """
+    row = conn.execute(
+        "SELECT json, fetched_at FROM sponsors WHERE key = ?", (_cache_key(sponsor),)
+    ).fetchone()
+    if not row or time.time() - row[1] > ttl:
+        return None
+    return json.loads(row[0])
+
+def cache_put(conn, sponsor, resolution):
+    """
+    Stores a resolution dict for a sponsor (caller commits).
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO sponsors (key, json, fetched_at) VALUES (?, ?, ?)",
+        (_cache_key(sponsor), json.dumps(resolution), int(time.time()))
+    )
+
+# Characters that force a CSV field to be quoted (csv.QUOTE_MINIMAL, excel dialect)
+_CSV_SPECIAL_RE = re.compile(r'[",\r\n]')
+
+def _csv_field(value):
+    """
+    Formats one field exactly as csv.writer would with the default dialect.
+    """
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        value = str(value)
+    if _CSV_SPECIAL_RE.search(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def _csv_line(fields):
+    """
+    Formats a full CSV record including the excel dialect's CRLF terminator.
+    """
+    return ",".join(map(_csv_field, fields)) + "\r\n"
+
+def _format_resolution(sponsor, uri, enrichment):
+    """
+    Formats a sponsor's Wikidata match and enrichment into the CSV resolution columns.
+    """
+    if not uri:
+        return {
+            "name": sponsor,
+            "ticker": "N/A",
+            "exchange": "N/A",
+            "status": "Unresolved",
+            "uri": ""
+        }
+    
+    if enrichment is None:
+        # Stage 2 failed for this URI: format it unenriched (main() does not cache it)
+        enrichment = {}
+    
+    ticker_str = "; ".join(sorted(enrichment["tickers"])) if enrichment.get("tickers") else "Private/Unlisted"
+    exchange_str = "; ".join(sorted(enrichment["exchanges"])) if enrichment.get("exchanges") else "N/A"
+    status_str = "Inactive" if enrichment.get("dissolved") else "Active"
+    parent_name = list(enrichment["parents"])[0] if enrichment.get("parents") else sponsor
+    
+    return {
+        "name": parent_name, # Use Parent/Current Name
+        "ticker": ticker_str,
+        "exchange": exchange_str,
+        "status": status_str,
+        "uri": uri
+    }
+
 import argparse
 
 def main():
@@ -89,15 +219,15 @@ def main():
 
     # 1. Load Data
     print("--- Step 1: Extracting Products ---")
-    sponsor_product_map = load_and_group_products(INPUT_FILE)
-    
-    unique_sponsors = list(sponsor_product_map.keys())
+    # Pass 1 only collects sponsor names (in first-seen order); products are streamed later
+    unique_sponsors = list(dict.fromkeys(iter_sponsor_names(INPUT_FILE)))
     print(f"Found {len(unique_sponsors)} unique sponsors.")
     
     # Filter sponsors if requested
     if args.filter:
         print(f"Filtering for sponsors containing '{args.filter}'...")
-        unique_sponsors = [s for s in unique_sponsors if args.filter.lower() in s.lower()]
+        needle = args.filter.lower()
+        unique_sponsors = [s for s in unique_sponsors if needle in s.lower()]
         print(f"Found {len(unique_sponsors)} matching sponsors.")
     
     # Limit if requested
@@ -119,73 +249,101 @@ def main():
     resolved_cache = {}
     unresolved_sponsors = []
     
+    # Reuse resolutions from previous runs
+    sponsor_cache = open_sponsor_cache()
+    for sponsor in unique_sponsors:
+        cached = cache_get(sponsor_cache, sponsor)
+        if cached:
+            resolved_cache[sponsor] = cached
+    print(f"Loaded {len(resolved_cache)} sponsors from {SPONSOR_CACHE_FILE}.")
+    
     # Output file name adjusts if filter used
     output_filename = OUTPUT_FILE
     if args.filter:
         output_filename = f"products_{args.filter.lower().replace(' ', '_')}.csv"
     
-    with open(output_filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
+    # Resolve all sponsors concurrently (network-bound), then write sequentially
+    pending = [s for s in unique_sponsors if s not in resolved_cache]
+    
+    # Group name variants so each canonical sponsor is looked up once (first-seen spelling)
+    canon_to_originals = defaultdict(list)
+    for sponsor in pending:
+        canon_to_originals[canonical_sponsor(sponsor)].append(sponsor)
+    representatives = [originals[0] for originals in canon_to_originals.values()]
+    print(f"{len(pending)} sponsors to resolve ({len(representatives)} after canonicalization).")
+
+    # Exact label matches in bulk first; workers then only search for the leftovers
+    matched = find_companies_by_names(representatives, batch_size=NAME_BATCH_SIZE)
+    print(f"Matched {len(matched)}/{len(representatives)} sponsors by exact label.")
+
+    # 1. Find URIs: search fallback for the leftovers runs concurrently (network-bound),
+    # with resolve_sponsor's worker cap so both scripts stay within WDQS's parallel-query limit
+    sponsor_uris = {}
+    with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS) as ex:
+        futures = {ex.submit(find_company_by_name, s): s for s in representatives}
+        for i, future in enumerate(as_completed(futures)):
+            sponsor = futures[future]
+            print(f"Resolved sponsor {i+1}/{len(representatives)}: {sponsor}...", end='\r')
+            try:
+                sponsor_uris[sponsor] = future.result()
+            except LookupUnavailable as e:
+                # Left unresolved (and uncached) for this run; retried next run
+                print(f"\nLookup unavailable for '{sponsor}': {e}", file=sys.stderr)
+                sponsor_uris[sponsor] = None
+    
+    # 2. Enrich all matched URIs with batched queries
+    uri_to_sponsor = {uri: sponsor for sponsor, uri in sponsor_uris.items() if uri}
+    print(f"\nEnriching {len(uri_to_sponsor)} companies...")
+    enrichments = enrich_companies_bulk(uri_to_sponsor)
+    
+    # Fan the shared match back out to every spelling of the sponsor
+    for originals in canon_to_originals.values():
+        uri = sponsor_uris[originals[0]]
+        for sponsor in originals:
+            resolution = _format_resolution(sponsor, uri, enrichments.get(uri))
+            resolved_cache[sponsor] = resolution
+        # Only matched and enriched lookups are persisted so transient misses
+        # and failed Stage 2 queries get retried next run
+        if uri in enrichments:
+            cache_put(sponsor_cache, originals[0], resolution)
+    sponsor_cache.commit()
+    sponsor_cache.close()
+    
+    for sponsor in unique_sponsors:
+        if resolved_cache[sponsor]["status"] == "Unresolved":
+            unresolved_sponsors.append(sponsor)
+    
+    # 3. Pass 2: stream products straight to CSV, joining on the resolved sponsors
+    print("\n--- Step 3: Writing Products ---")
+    # Resolution columns are identical for every product of a sponsor, so they are
+    # quoted and joined once into a ready-made line suffix
+    sponsor_suffixes = {}
+    for sponsor in unique_sponsors:
+        resolution = resolved_cache[sponsor]
+        sponsor_suffixes[sponsor] = "," + _csv_line((
+            sponsor,
+            resolution["name"],
+            resolution["ticker"],
+            resolution["exchange"],
+            resolution["status"],
+            resolution["uri"]
+        ))
+    
+    with open(output_filename, 'w', newline='', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as csvfile:
+        csvfile.write(_csv_line(fieldnames))
         
-        for i, sponsor in enumerate(unique_sponsors):
-            # Progress update
-            print(f"Resolving sponsor {i+1}/{len(unique_sponsors)}: {sponsor}...", end='\r')
-            
-            # Resolve Sponsor (or get from cache)
-            if sponsor in resolved_cache:
-                resolution = resolved_cache[sponsor]
-            else:
-                # 1. Find URI
-                uri = find_company_by_name(sponsor) # Imports from resolve_sponsor
-                
-                if uri:
-                    # 2. Enrich
-                    enrichment = enrich_company_content(uri, sponsor)
-                    
-                    # Format
-                    ticker_str = "; ".join(sorted(enrichment["tickers"])) if enrichment["tickers"] else "Private/Unlisted"
-                    exchange_str = "; ".join(sorted(enrichment["exchanges"])) if enrichment["exchanges"] else "N/A"
-                    status_str = "Inactive" if enrichment.get("dissolved") else "Active"
-                    parent_name = list(enrichment["parents"])[0] if enrichment["parents"] else sponsor
-                    
-                    resolution = {
-                        "name": parent_name, # Use Parent/Current Name
-                        "ticker": ticker_str,
-                        "exchange": exchange_str,
-                        "status": status_str,
-                        "uri": uri
-                    }
-                else:
-                    resolution = {
-                        "name": sponsor,
-                        "ticker": "N/A",
-                        "exchange": "N/A",
-                        "status": "Unresolved",
-                        "uri": ""
-                    }
-                    unresolved_sponsors.append(sponsor)
-                
-                resolved_cache[sponsor] = resolution
-            
-            # Write all products for this sponsor
-            products = sponsor_product_map[sponsor]
-            for prod in products:
-                row = {
-                    "product_name": prod["product_name"],
-                    "active_ingredients_name": prod["active_ingredients_name"],
-                    "active_ingredients_strength": prod["active_ingredients_strength"],
-                    "rxcui": prod["rxcui"],
-                    "marketing_status": prod["marketing_status"],
-                    "dosage_form": prod["dosage_form"],
-                    "openfda_sponsor_name": sponsor,
-                    "resolved_sponsor_name": resolution["name"],
-                    "ticker": resolution["ticker"],
-                    "exchange": resolution["exchange"],
-                    "status": resolution["status"],
-                    "wikidata_uri": resolution["uri"]
-                }
-                writer.writerow(row)
+        lines_batch = []
+        for sponsor, prod in iter_products(INPUT_FILE):
+            suffix = sponsor_suffixes.get(sponsor)
+            if suffix is None:
+                continue
+            lines_batch.append(",".join(map(_csv_field, prod)) + suffix)
+            if len(lines_batch) >= ROW_BATCH_SIZE:
+                csvfile.write("".join(lines_batch))
+                lines_batch.clear()
+                # Explicit flush only at batch boundaries, never per row
+                csvfile.flush()
+        csvfile.write("".join(lines_batch))
     
     # Write Unresolved Sponsors List
     with open("unresolved_sponsors.csv", "w", newline="", encoding="utf-8") as f:
@@ -1,5 +1,7 @@
 import argparse
+import re
 import sys
+import orjson
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -7,7 +9,82 @@ from urllib3.util.retry import Retry
 # Use standard Wikidata SPARQL endpoint
 QLEVER_ENDPOINT = "https://query.wikidata.org/sparql"
 # Standard User-Agent for Wikidata policy
-HEADERS = {"User-Agent": "BiotechAnalyzer/1.0 ([EMAIL_ADDRESS])"}
+HEADERS = {"User-Agent": "BiotechAnalyzer/1.0 ([EMAIL_ADDRESS])", "Accept-Encoding": "gzip"}
+
+# Strings that can plausibly be a ticker symbol (e.g. NVO, BRK.B, NOVN.SW, 4502, 068270);
+# only obvious non-tickers (whitespace, lowercase words, long strings) skip the exact P249 lookup
+TICKER_RE = re.compile(r"^[A-Z0-9][A-Z0-9.\-]{0,9}$")
+
+# SPARQL templates, formatted per call with str.format (hence the doubled braces)
+
+# Exact ticker match; FILTER on STR() to be safer against string types
+_TICKER_QUERY = """
+    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+
+    SELECT DISTINCT ?company ?companyLabel WHERE {{
+        ?company wdt:P249 ?ticker .
+        FILTER(STR(?ticker) = "{ticker}")
+        
+        OPTIONAL {{ 
+            ?company rdfs:label ?companyLabel .
+            FILTER (lang(?companyLabel) = "en") 
+        }}
+    }}
+    LIMIT 1
+    """
+
+# Relaxed verify query: get candidates and ANY P249 they might have,
+# also check p:P414 (Exchange) -> pq:P249 (Ticker)
+_VERIFY_QUERY = """
+    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+    PREFIX p: <http://www.wikidata.org/prop/>
+    PREFIX ps: <http://www.wikidata.org/prop/statement/>
+    PREFIX pq: <http://www.wikidata.org/prop/qualifier/>
+    
+    SELECT ?item ?ticker ?ticker2 ?ticker3 ?companyRef ?companyRefLabel ?operatorRef ?operatorRefLabel WHERE {{
+        VALUES ?item {{ {values_str} }}
+        OPTIONAL {{ ?item wdt:P249 ?ticker . }}
+        OPTIONAL {{ ?item p:P249/ps:P249 ?ticker2 . }}
+        OPTIONAL {{ 
+            ?item p:P414 ?exchangeStmt .
+            ?exchangeStmt pq:P249 ?ticker3 .
+        }}
+        # Check if item itself IS the stock (ADR/listing) and points to company
+        OPTIONAL {{ ?item wdt:P361 ?companyRef . ?companyRef rdfs:label ?companyRefLabel . FILTER(LANG(?companyRefLabel)="en") }}
+        OPTIONAL {{ ?item wdt:P137 ?operatorRef . ?operatorRef rdfs:label ?operatorRefLabel . FILTER(LANG(?operatorRefLabel)="en") }}
+        OPTIONAL {{ ?item skos:altLabel ?alias . FILTER(LANG(?alias)="en") }}
+    }}
+    """
+
+_PRODUCTS_QUERY = """
+    PREFIX wd: <http://www.wikidata.org/entity/>
+    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+
+    SELECT DISTINCT ?product ?productLabel WHERE {{
+        {{
+            wd:{company_qid} wdt:P1056 ?product .
+        }} UNION {{
+            ?product wdt:P176 wd:{company_qid} .
+        }}
+        ?product rdfs:label ?productLabel .
+        FILTER (lang(?productLabel) = "en")
+        
+        # Filter out generic terms
+        FILTER (?productLabel != "medication"@en)
+        FILTER (?productLabel != "pharmaceutical product"@en)
+        FILTER (?productLabel != "drug"@en)
+    }}
+    LIMIT 50
+    """
+
+def _bind(row, key, default=None):
+    """
+    Returns the value of a SPARQL result binding, or `default` if unbound.
+    """
+    binding = row.get(key)
+    return binding["value"] if binding else default
 
 def _get_session():
     session = requests.Session()
@@ -15,7 +92,8 @@ def _get_session():
         total=5,
         backoff_factor=1.0, # 1s, 2s, 4s, 8s, 16s...
         status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS"]
+        # SPARQL queries are read-only, so retrying POST is safe
+        allowed_methods=["HEAD", "GET", "OPTIONS", "POST"]
     )
     adapter = HTTPAdapter(max_retries=retry)
     session.mount("https://", adapter)
@@ -31,14 +109,16 @@ def _run_sparql_query(query: str, purpose: str):
     timeout = 60
     
     try:
-        response = SESSION.get(
+        # POST keeps large queries out of the URL; the response comes back gzipped
+        response = SESSION.post(
             QLEVER_ENDPOINT,
-            params={"query": query, "format": "json"},
+            data={"query": query, "format": "json"},
             headers=HEADERS,
             timeout=timeout
         )
         response.raise_for_status()
-        data = response.json()
+        # orjson decodes the (often large) JSON payload several times faster than stdlib json
+        data = orjson.loads(response.content)
         bindings = data["results"]["bindings"]
         if not bindings:
              print(f"DEBUG: SPARQL query returned 0 bindings.", file=sys.stderr)
@@ -55,30 +135,19 @@ def get_company_by_ticker(ticker: str):
     """
     Finds the company URI and label associated with the Ticker Symbol (P249).
     """
-    # Use FILTER for ticker to be safer against string types
-    query = f"""
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-
-    SELECT DISTINCT ?company ?companyLabel WHERE {{
-        ?company wdt:P249 ?ticker .
-        FILTER(STR(?ticker) = "{ticker}")
+    rows = None
+    if TICKER_RE.match(ticker.strip()):
+        query = _TICKER_QUERY.format(ticker=ticker)
         
-        OPTIONAL {{ 
-            ?company rdfs:label ?companyLabel .
-            FILTER (lang(?companyLabel) = "en") 
-        }}
-    }}
-    LIMIT 1
-    """
-    
-    print(f"DEBUG: Running query for ticker {ticker}...")
-    rows = _run_sparql_query(query, f"Ticker-{ticker}")
+        print(f"DEBUG: Running query for ticker {ticker}...")
+        rows = _run_sparql_query(query, f"Ticker-{ticker}")
+    else:
+        print(f"DEBUG: '{ticker}' does not look like a ticker, skipping direct lookup.")
     
     if rows:
         row = rows[0]
-        uri = row.get("company", {}).get("value")
-        label = row.get("companyLabel", {}).get("value", "Unknown")
+        uri = _bind(row, "company")
+        label = _bind(row, "companyLabel", "Unknown")
         print(f"DEBUG: Found {label} ({uri})")
         return {
             "company_uri": uri,
@@ -102,7 +171,7 @@ def get_company_by_ticker(ticker: str):
     try:
         resp = SESSION.get(api_url, params=params, headers=HEADERS, timeout=10)
         resp.raise_for_status()
-        search_results = resp.json().get("search", [])
+        search_results = orjson.loads(resp.content).get("search", [])
     except Exception as e:
         print(f"DEBUG: Search API failed: {e}", file=sys.stderr)
         return None
@@ -115,64 +184,27 @@ def get_company_by_ticker(ticker: str):
     candidate_qids = list(candidate_map.keys())
     values_str = " ".join([f"wd:{q}" for q in candidate_qids])
     
-    # Relaxed verify query: Get candidates and ANY P249 they might have
-    # Also check p:P414 (Exchange) -> pq:P249 (Ticker)
-    verify_query = f"""
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    PREFIX p: <http://www.wikidata.org/prop/>
-    PREFIX ps: <http://www.wikidata.org/prop/statement/>
-    PREFIX pq: <http://www.wikidata.org/prop/qualifier/>
-    
-    SELECT ?item ?ticker ?ticker2 ?ticker3 WHERE {{
-        VALUES ?item {{ {values_str} }}
-        OPTIONAL {{ ?item wdt:P249 ?ticker . }}
-        OPTIONAL {{ ?item p:P249/ps:P249 ?ticker2 . }}
-        OPTIONAL {{ 
-            ?item p:P414 ?exchangeStmt .
-            ?exchangeStmt pq:P249 ?ticker3 .
-        }}
-    }}
-    """
-    
-    verify_query = f"""
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    PREFIX p: <http://www.wikidata.org/prop/>
-    PREFIX ps: <http://www.wikidata.org/prop/statement/>
-    PREFIX pq: <http://www.wikidata.org/prop/qualifier/>
-    
-    SELECT ?item ?ticker ?ticker2 ?ticker3 ?companyRef ?companyRefLabel ?operatorRef ?operatorRefLabel WHERE {{
-        VALUES ?item {{ {values_str} }}
-        OPTIONAL {{ ?item wdt:P249 ?ticker . }}
-        OPTIONAL {{ ?item p:P249/ps:P249 ?ticker2 . }}
-        OPTIONAL {{ 
-            ?item p:P414 ?exchangeStmt .
-            ?exchangeStmt pq:P249 ?ticker3 .
-        }}
-        # Check if item itself IS the stock (ADR/listing) and points to company
-        OPTIONAL {{ ?item wdt:P361 ?companyRef . ?companyRef rdfs:label ?companyRefLabel . FILTER(LANG(?companyRefLabel)="en") }}
-        OPTIONAL {{ ?item wdt:P137 ?operatorRef . ?operatorRef rdfs:label ?operatorRefLabel . FILTER(LANG(?operatorRefLabel)="en") }}
-        OPTIONAL {{ ?item skos:altLabel ?alias . FILTER(LANG(?alias)="en") }}
-    }}
-    """
+    verify_query = _VERIFY_QUERY.format(values_str=values_str)
     
     verify_rows = _run_sparql_query(verify_query, f"Verify-{ticker}")
     
     if verify_rows:
+        ticker_upper = ticker.strip().upper()
         for r in verify_rows:
-            t1 = r.get("ticker", {}).get("value")
-            t2 = r.get("ticker2", {}).get("value")
-            t3 = r.get("ticker3", {}).get("value")
+            t1 = _bind(r, "ticker")
+            t2 = _bind(r, "ticker2")
+            t3 = _bind(r, "ticker3")
             
             # Pick first non-null
             found_ticker = t1 or t2 or t3
             
-            uri = r.get("item", {}).get("value")
+            uri = _bind(r, "item")
             qid = uri.split("/")[-1]
             label = candidate_map.get(qid, "Unknown")
-            alias = r.get("alias", {}).get("value")
+            alias = _bind(r, "alias")
             
             # Case 1: The item found HAS the ticker property
-            if found_ticker and found_ticker.strip().upper() == ticker.strip().upper():
+            if found_ticker and found_ticker.strip().upper() == ticker_upper:
                 print(f"DEBUG: Match found! {label} ({uri})")
                 return {
                     "company_uri": uri,
@@ -180,9 +212,9 @@ def get_company_by_ticker(ticker: str):
                 }
             
             # Case 2: The item IS the ticker/stock (e.g. "NVO" item) and points to company
-            if (label.strip().upper() == ticker.strip().upper() or "ADR" in label):
-                 company_uri = r.get("companyRef", {}).get("value") or r.get("operatorRef", {}).get("value")
-                 company_lbl = r.get("companyRefLabel", {}).get("value") or r.get("operatorRefLabel", {}).get("value")
+            if (label.strip().upper() == ticker_upper or "ADR" in label):
+                 company_uri = _bind(r, "companyRef") or _bind(r, "operatorRef")
+                 company_lbl = _bind(r, "companyRefLabel") or _bind(r, "operatorRefLabel")
                  
                  if company_uri:
                       print(f"DEBUG: Ticker/ADR item found: {label} -> Linked Company: {company_lbl} ({company_uri})")
@@ -192,7 +224,7 @@ def get_company_by_ticker(ticker: str):
                       }
             
             # Case 3: The item found HAS the ticker as an alias (and is a business)
-            if alias and alias.strip().upper() == ticker.strip().upper():
+            if alias and alias.strip().upper() == ticker_upper:
                  # Confirm it is likely a company (has products or is subclass of business)
                  print(f"DEBUG: Alias match found! {label} ({uri}) matches '{alias}'")
                  return {
@@ -209,35 +241,15 @@ def get_products_for_company(company_uri: str):
     """
     company_qid = company_uri.split("/")[-1]
     
-    query = f"""
-    PREFIX wd: <http://www.wikidata.org/entity/>
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-
-    SELECT DISTINCT ?product ?productLabel WHERE {{
-        {{
-            wd:{company_qid} wdt:P1056 ?product .
-        }} UNION {{
-            ?product wdt:P176 wd:{company_qid} .
-        }}
-        ?product rdfs:label ?productLabel .
-        FILTER (lang(?productLabel) = "en")
-        
-        # Filter out generic terms
-        FILTER (?productLabel != "medication"@en)
-        FILTER (?productLabel != "pharmaceutical product"@en)
-        FILTER (?productLabel != "drug"@en)
-    }}
-    LIMIT 50
-    """
+    query = _PRODUCTS_QUERY.format(company_qid=company_qid)
     
     rows = _run_sparql_query(query, f"Products-{company_qid}") or []
     
     products = []
     for row in rows:
         products.append({
-            "product_uri": row.get("product", {}).get("value"),
-            "product_label": row.get("productLabel", {}).get("value")
+            "product_uri": _bind(row, "product"),
+            "product_label": _bind(row, "productLabel")
         })
     return products
 
@@ -1,9 +1,22 @@
 import argparse
 import csv
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
 import sys
+import threading
 import time
+import orjson
 import requests
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 """
@@ -22,92 +35,460 @@ Features:
 # Use standard Wikidata SPARQL endpoint
 QLEVER_ENDPOINT = "https://query.wikidata.org/sparql"
 # Standard User-Agent for Wikidata policy
-# Standard User-Agent for Wikidata policy
-HEADERS = {"User-Agent": "BiotechAnalyzer/1.0 (contact@example.com)"}
+HEADERS = {"User-Agent": "BiotechAnalyzer/1.0 (contact@example.com)", "Accept-Encoding": "gzip"}
+
+# Concurrent record resolutions in main(); kept low per Wikidata etiquette
+RESOLVE_WORKERS = 5
+
+# Trial records resolved and written per chunk in main()
+RECORD_CHUNK_SIZE = 1000
+
+# NCT IDs per batched Stage 1 identity query
+IDENTITY_BATCH_SIZE = 100
+
+# Company QIDs per batched Stage 2 enrichment query (the hierarchy traversal is expensive)
+ENRICH_BATCH_SIZE = 50
+
+# Persistent cache of Wikidata responses (SPARQL + search API) across runs.
+# Set to None to disable.
+HTTP_CACHE_FILE = "wikidata_cache.sqlite"
+HTTP_CACHE_TTL = 7 * 24 * 3600 # 7 days
+
+# Common corporate suffixes to remove (case insensitive), compiled once.
+# The outer + strips stacked suffixes ("Foo Corp. Ltd" -> "Foo") like the old per-suffix loop
+CORPORATE_SUFFIX_RE = re.compile(
+    r"(?:,?\s+(?:Inc\.?|Incorporated|LLC|L\.L\.C\.|LP|L\.P\.|Ltd\.?|Limited"
+    r"|Corp\.?|Corporation|PLC|S\.A\.|GmbH|N\.V\.|B\.V\.))+$",
+    re.IGNORECASE
+)
+
+# Pharma/biotech and legal suffixes stripped to get a base name for Smart Search
+SEARCH_SUFFIX_RE = re.compile(
+    r"(?:\s+(?:Pharmaceuticals?|Biotech|Therapeutics|Biosciences|Company|Sciences)"
+    r"|,?\s+(?:Inc\.?|LLC|LP|Ltd\.?))+$",
+    re.IGNORECASE
+)
 
 # Cache for Company Name -> Wikidata URI
 COMPANY_URI_CACHE = {}
 
+# Cache for Sponsor Name -> best QID from Smart Search
+SEARCH_ID_CACHE = {}
+
+# Cache for QID -> claim summary from wbgetentities
+ENTITY_CACHE = {}
+
+# Cache for Sponsor Name -> (company URI, label) from Stage 1 links of trials with a
+# single INDUSTRY sponsor row (a multi-sponsor trial's P859 can't be tied to one name)
+SPONSOR_LINK_CACHE = {}
+
+# Cache for candidate QID tuple -> best company QID
+VALIDATION_CACHE = {}
+
+# wbgetentities accepts at most 50 ids per call
+WBGETENTITIES_MAX = 50
+
+# Claims that feed candidate scoring: ticker, parent, owner, replaced by, dissolved
+SCORED_PROPERTIES = ("P249", "P749", "P127", "P1366", "P576")
+
+# On-disk snapshot of the instance-of (P31) classes accepted as a company (every
+# subclass of organization/business, see company_classes()), refreshed after 30 days.
+COMPANY_CLASSES_FILE = "company_classes.json"
+COMPANY_CLASSES_TTL = 30 * 24 * 3600
+# Seconds to wait before re-running a failed subclass query (validation fails meanwhile)
+COMPANY_CLASSES_RETRY_AFTER = 60
+
 # Cache for URI -> Enriched Data
 ENRICHMENT_CACHE = {}
 
 # Setup requests Session with Retry
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
 def _get_session():
+    # One shared keep-alive session: connections (and TLS handshakes) are reused
+    # across every SPARQL/API call instead of opened per request
     session = requests.Session()
+    session.headers.update(HEADERS)
     retry = Retry(
         total=5,
         backoff_factor=1.0, # 1s, 2s, 4s, 8s, 16s...
+        backoff_jitter=0.5, # spread concurrent workers' retries apart
         status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS"]
+        allowed_methods=["HEAD", "GET", "OPTIONS"],
+        # On 429/503 sleep for the server's Retry-After instead of the backoff delay
+        respect_retry_after_header=True
+    )
+    # Pool sized for concurrent resolution from worker threads
+    adapter = HTTPAdapter(
+        max_retries=retry,
+        pool_connections=32,
+        pool_maxsize=32,
+        pool_block=False
     )
-    adapter = HTTPAdapter(max_retries=retry)
     session.mount("https://", adapter)
     session.mount("http://", adapter)
     return session
 
 SESSION = _get_session()
 
+class Breaker:
+    """
+    Circuit breaker shared by all Wikidata calls. Opens after `fail_threshold`
+    consecutive failures and rejects calls for `reset_after` seconds, so an outage
+    skips records quickly instead of spending the full retry budget on each one.
+    After the cool-down a single probe call is let through while other callers are
+    still rejected; success closes the breaker, failure re-opens it for another cool-down.
+    """
+    def __init__(self, fail_threshold=5, reset_after=30):
+        self.fail_threshold = fail_threshold
+        self.reset_after = reset_after
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.half_open = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_after:
+                # Half-open: admit one probe and restart the cool-down so concurrent
+                # callers keep getting False until the probe reports back (or times out)
+                self.opened_at = time.time()
+                self.half_open = True
+                return True
+            return False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.half_open:
+                self.opened_at = time.time()
+                self.half_open = False
+                print(f"Wikidata circuit breaker probe failed; open for another {self.reset_after}s.",
+                      file=sys.stderr)
+            elif self.consecutive_failures >= self.fail_threshold and self.opened_at is None:
+                self.opened_at = time.time()
+                print(f"Wikidata circuit breaker open for {self.reset_after}s after "
+                      f"{self.consecutive_failures} consecutive failures.", file=sys.stderr)
+
+    def reset(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.half_open = False
+
+BREAKER = Breaker()
+
+class LookupUnavailable(Exception):
+    """
+    Raised when a name lookup could not complete because a Wikidata call failed or
+    was skipped by the open breaker. Unlike a None "no match", it is never memoized.
+    """
+
+def _record_error(e):
+    """
+    Feeds a request exception to the breaker. Client errors (bad query, 4xx other
+    than 429) say nothing about endpoint health and are not counted.
+    """
+    response = getattr(e, 'response', None)
+    if response is not None and 400 <= response.status_code < 500 and response.status_code != 429:
+        return
+    BREAKER.record_failure()
+
+_http_cache_conn = None
+_http_cache_lock = threading.Lock()
+
+def _http_cache():
+    """
+    Lazily opens the SQLite response cache (shared across worker threads).
+    """
+    global _http_cache_conn
+    if _http_cache_conn is None:
+        conn = sqlite3.connect(HTTP_CACHE_FILE, check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, json BLOB, fetched_at INT)"
+        )
+        _http_cache_conn = conn
+    return _http_cache_conn
+
+def _http_cache_key(endpoint, request_key):
+    return hashlib.sha256(f"{endpoint}\n{request_key}".encode("utf-8")).hexdigest()
+
+def _http_cache_get(endpoint, request_key):
+    """
+    Returns the cached decoded response for (endpoint, request), or None if missing/expired.
+    """
+    if not HTTP_CACHE_FILE:
+        return None
+    with _http_cache_lock:
+        row = _http_cache().execute(
+            "SELECT json, fetched_at FROM responses WHERE key = ?",
+            (_http_cache_key(endpoint, request_key),)
+        ).fetchone()
+    if not row or time.time() - row[1] > HTTP_CACHE_TTL:
+        return None
+    return orjson.loads(row[0])
+
+def _http_cache_put(endpoint, request_key, value):
+    """
+    Stores a decoded response for (endpoint, request), orjson-encoded as a BLOB.
+    """
+    if not HTTP_CACHE_FILE:
+        return
+    with _http_cache_lock:
+        conn = _http_cache()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, json, fetched_at) VALUES (?, ?, ?)",
+            (_http_cache_key(endpoint, request_key), orjson.dumps(value), int(time.time()))
+        )
+        conn.commit()
+
 def _run_sparql_query(query: str, purpose: str):
     """
     Helper to run SPARQL query with retries and timeout.
     """
     timeout = 60
     
+    cached = _http_cache_get(QLEVER_ENDPOINT, query)
+    if cached is not None:
+        return cached
+    
+    if not BREAKER.allow():
+        print(f"Skipping query ({purpose}): circuit breaker open", file=sys.stderr)
+        return None
+    
     try:
         response = SESSION.get(
             QLEVER_ENDPOINT,
             params={"query": query, "format": "json"},
-            headers=HEADERS,
             timeout=timeout
         )
         response.raise_for_status()
-        return response.json()["results"]["bindings"]
+        bindings = orjson.loads(response.content)["results"]["bindings"]
+        BREAKER.reset()
+        _http_cache_put(QLEVER_ENDPOINT, query, bindings)
+        return bindings
     except Exception as e:
+        _record_error(e)
         error_msg = str(e)
         if hasattr(e, 'response') and e.response is not None:
             error_msg += f"\nResponse: {e.response.text}"
         print(f"Error querying ({purpose}): {error_msg}", file=sys.stderr)
         return None
 
-def get_trial_primary_sponsor(nct_id: str):
+_company_classes = None
+_company_classes_failed_at = None
+_company_classes_lock = threading.Lock()
+
+def company_classes():
     """
-    Stage 1: Lightweight Identity Query.
-    Finds the company URI and label associated with the NCT ID.
+    Returns the frozenset of QIDs that are subclasses (P279*) of organization (Q43229)
+    or business (Q4830453), so P31 values can be checked locally without a
+    transitive-closure query per validation.
+    Loaded once per process from COMPANY_CLASSES_FILE, or fetched with a single SPARQL
+    query and saved there. If the query fails, raises LookupUnavailable rather than
+    validating against a partial class list, and retries after COMPANY_CLASSES_RETRY_AFTER.
     """
-    query = f"""
-    PREFIX wdt: <http://www.wikidata.org/prop/direct/>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-
-    SELECT DISTINCT ?trialLabel ?company ?companyLabel WHERE {{
-        ?trial wdt:P3098 "{nct_id}" ;
-               rdfs:label ?trialLabel .
+    global _company_classes, _company_classes_failed_at
+    with _company_classes_lock:
+        if _company_classes is not None:
+            return _company_classes
         
-        OPTIONAL {{ ?trial wdt:P859 ?company . }}
+        try:
+            if time.time() - os.path.getmtime(COMPANY_CLASSES_FILE) < COMPANY_CLASSES_TTL:
+                with open(COMPANY_CLASSES_FILE, 'r', encoding='utf-8') as f:
+                    _company_classes = frozenset(json.load(f))
+                return _company_classes
+        except (OSError, ValueError):
+            pass
         
-        FILTER (lang(?trialLabel) = "en")
+        if (_company_classes_failed_at is not None
+                and time.time() - _company_classes_failed_at < COMPANY_CLASSES_RETRY_AFTER):
+            raise LookupUnavailable("company subclass list unavailable")
         
-        SERVICE wikibase:label {{
-            bd:serviceParam wikibase:language "en".
-        }}
-    }}
-    LIMIT 1
+        query = """
+        PREFIX wd: <http://www.wikidata.org/entity/>
+        PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+
+        SELECT DISTINCT ?class WHERE {
+            { ?class wdt:P279* wd:Q43229 . }
+            UNION
+            { ?class wdt:P279* wd:Q4830453 . }
+        }
+        """
+        rows = _run_sparql_query(query, "CompanyClasses")
+        if not rows:
+            # Not stored: the next call after the back-off queries again
+            _company_classes_failed_at = time.time()
+            print(f"Warning: could not load company subclasses; retrying in {COMPANY_CLASSES_RETRY_AFTER}s.", file=sys.stderr)
+            raise LookupUnavailable("company subclass list unavailable")
+        
+        qids = sorted({row["class"]["value"].split('/')[-1] for row in rows})
+        try:
+            with open(COMPANY_CLASSES_FILE, 'w', encoding='utf-8') as f:
+                json.dump(qids, f)
+        except OSError as e:
+            print(f"Warning: could not save {COMPANY_CLASSES_FILE}: {e}", file=sys.stderr)
+        _company_classes = frozenset(qids)
+        return _company_classes
+
+def _company_label(row):
     """
+    English label of the linked company, falling back to its QID when the
+    company has no English label (matching what the label service returned).
+    """
+    if "companyLabel" in row:
+        return row["companyLabel"]["value"]
+    if "company" in row:
+        return row["company"]["value"].split('/')[-1]
+    return None
+
+def get_trial_primary_sponsor(nct_id: str):
+    """
+    Stage 1: Identity Query for a single trial.
+    Finds the company URI and label associated with the NCT ID.
+    Raises LookupUnavailable if the query failed.
+    """
+    return resolve_trials_batch([nct_id])[nct_id]
+
+def _empty_enrichment():
+    """
+    Fallback default if enrichment yields nothing.
+    """
+    return {
+        "parents": set(),
+        "subsidiaries": set(),
+        "tickers": set(),
+        "exchanges": set(),
+        "countries": set(),
+        "sec_cik": None,
+        "dissolved": False
+    }
+
+def _enrichment_from_row(res):
+    """
+    Maps the best enrichment row to the structure expected by the CSV logic.
+    """
+    ticker = res.get('ticker', {}).get('value', "PRIVATE")
     
-    rows = _run_sparql_query(query, f"Identity-{nct_id}")
-    if not rows:
-        return {"nct_id": nct_id, "trial_label": "Unknown", "company_uri": None, "company_label": None}
+    # Map back to the expected structure for existing CSV logic
+    # Note: original code expected plural sets (parents, tickers, etc).
+    # We simplified to singular best-match for stability.
     
-    row = rows[0]
     return {
-        "nct_id": nct_id,
-        "trial_label": row.get("trialLabel", {}).get("value", "Unknown"),
-        "company_uri": row.get("company", {}).get("value"),
-        "company_label": row.get("companyLabel", {}).get("value")
+        "parents": {res.get("currentName", {}).get("value")},
+        "subsidiaries": set(),
+        "tickers": {ticker} if ticker != "PRIVATE" else set(),
+        "exchanges": {res.get("exchangeLabel", {}).get("value")} if "exchangeLabel" in res else set(),
+        "countries": set(),
+        "sec_cik": None,
+        "dissolved": "dissolved" in res
     }
 
+def _best_enrichment_row(rows):
+    """
+    Client-side equivalent of ORDER BY DESC(?ticker) ASC(?dissolved) LIMIT 1.
+    Unbound values sort first in SPARQL, so they go last for DESC and first for ASC.
+    """
+    rows = sorted(rows, key=lambda r: ("dissolved" in r, r.get("dissolved", {}).get("value", "")))
+    rows.sort(key=lambda r: ("ticker" in r, r.get("ticker", {}).get("value", "")), reverse=True)
+    return rows[0]
+
+# Stage 2 graph pattern shared by enrich_companies_bulk and resolve_trials_batch,
+# formatted with the variable holding the starting company (hence the doubled braces).
+# Follows P749 (Parent Org), P1366 (Replaced By), and P156 (Followed By)
+# to find the current active entity. Excludes P127 (Shareholder) to stay strictly corporate.
+# The walk is capped at 3 hops with chained optional steps; an unbounded
+# `*` path over three properties is expensive and prone to timeouts.
+_ENRICHMENT_PATTERN = """
+            # Traverse hierarchy to find parent (at most 3 hops)
+            ?{entity} (wdt:P1366|wdt:P156|wdt:P749)? ?e1.
+            ?e1 (wdt:P1366|wdt:P156|wdt:P749)? ?e2.
+            ?e2 (wdt:P1366|wdt:P156|wdt:P749)? ?currentEntity.
+            
+            FILTER NOT EXISTS {{ ?currentEntity wdt:P1366 ?futureReplacement. }}
+
+            ?currentEntity rdfs:label ?currentName.
+            FILTER(LANG(?currentName) = "en")
+
+            OPTIONAL {{ ?currentEntity wdt:P249 ?directTicker. }}
+            
+            OPTIONAL {{ 
+                ?currentEntity p:P414 ?exchangeStatement. 
+                ?exchangeStatement ps:P414 ?exchange.
+                ?exchange rdfs:label ?exchangeLabel.
+                FILTER(LANG(?exchangeLabel) = "en")
+                OPTIONAL {{ ?exchangeStatement pq:P249 ?qualifierTicker. }}
+            }}
+            
+            BIND(COALESCE(?directTicker, ?qualifierTicker) AS ?ticker)
+            
+            OPTIONAL {{ ?currentEntity wdt:P576 ?dissolved. }}
+"""
+
+def enrich_companies_bulk(uri_to_sponsor, batch_size=100):
+    """
+    Stage 2 (batched): Enrichment Query for many company URIs at once.
+    Uses a VALUES block over the company QIDs so one round trip covers a whole batch,
+    and groups the rows per input entity client-side.
+    Returns dict { uri: enrichment } and fills ENRICHMENT_CACHE. URIs whose batch
+    query failed are left out of the result (and uncached) so callers can tell a
+    failed lookup from a company with no enrichment data.
+    """
+    results = {}
+    pending = []
+    for uri in uri_to_sponsor:
+        if not uri:
+            continue
+        if uri in ENRICHMENT_CACHE:
+            results[uri] = ENRICHMENT_CACHE[uri]
+        else:
+            pending.append(uri)
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        values_str = " ".join(f"wd:{uri.split('/')[-1]}" for uri in chunk)
+        
+        query = f"""
+        PREFIX wd: <http://www.wikidata.org/entity/>
+        PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+
+        SELECT DISTINCT
+            ?entity
+            ?currentName
+            ?ticker
+            ?exchangeLabel
+            ?dissolved
+        WHERE {{
+            VALUES ?entity {{ {values_str} }}
+            {_ENRICHMENT_PATTERN.format(entity="entity")}
+        }}
+        """
+        
+        if len(chunk) == 1:
+            purpose = f"Enrich-{chunk[0].split('/')[-1]}"
+        else:
+            purpose = f"EnrichBatch-{start // batch_size}"
+        rows = _run_sparql_query(query, purpose)
+        if rows is None:
+            # Query failed: leave these URIs out and uncached so a later call retries
+            continue
+        
+        rows_by_entity = {}
+        for r in rows:
+            rows_by_entity.setdefault(r["entity"]["value"], []).append(r)
+        
+        for uri in chunk:
+            entity_rows = rows_by_entity.get(uri)
+            if entity_rows:
+                result = _enrichment_from_row(_best_enrichment_row(entity_rows))
+            else:
+                result = _empty_enrichment()
+            ENRICHMENT_CACHE[uri] = result
+            results[uri] = result
+
+    return results
+
 def enrich_company_content(company_uri: str, company_label: str):
     """
     Stage 2: Enrichment Query.
@@ -116,120 +497,97 @@ def enrich_company_content(company_uri: str, company_label: str):
     if not company_uri:
         return {}
         
-    if company_uri in ENRICHMENT_CACHE:
-        return ENRICHMENT_CACHE[company_uri]
+    return enrich_companies_bulk({company_uri: company_label}).get(company_uri, _empty_enrichment())
 
-    company_qid = company_uri.split("/")[-1]
+def _unknown_identity(nct_id):
+    """
+    Stage 1 identity for a trial with no sponsor link in Wikidata.
+    """
+    return {"nct_id": nct_id, "trial_label": "Unknown", "company_uri": None, "company_label": None}
+
+def resolve_trials_batch(nct_ids):
+    """
+    Stage 1 + Stage 2 fused: one query per NCT batch that follows each trial's
+    sponsor (P859) and walks the same hierarchy as enrich_companies_bulk.
+    Returns dict { nct_id: identity } with "Unknown" defaults for trials not found
+    in Wikidata, and fills ENRICHMENT_CACHE for every linked company, so Stage 2
+    only has to query companies found by name search.
+    Raises LookupUnavailable if the query failed, so callers can tell an outage
+    from trials that simply have no sponsor link.
+    """
+    nct_ids = list(dict.fromkeys(nct_ids))
+    identities = {nct_id: _unknown_identity(nct_id) for nct_id in nct_ids}
+    if not nct_ids:
+        return identities
     
-    # Improved Traversal: 
-    # Follows P749 (Parent Org), P1366 (Replaced By), and P156 (Followed By)
-    # to find the current active entity. Excludes P127 (Shareholder) to stay strictly corporate.
+    values_str = " ".join(_sparql_str(nct_id) for nct_id in nct_ids)
     query = f"""
     PREFIX wd: <http://www.wikidata.org/entity/>
     PREFIX wdt: <http://www.wikidata.org/prop/direct/>
     PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
 
-    SELECT DISTINCT
-        ?currentName
-        ?ticker
-        ?exchangeLabel
-        ?dissolved
-    WHERE {{
-        VALUES ?entity {{ wd:{company_qid} }}
-
-        # Traverse hierarchy to find parent
-        ?entity (wdt:P1366|wdt:P156|wdt:P749)* ?currentEntity.
+    SELECT DISTINCT ?nct ?trialLabel ?company ?companyLabel ?currentName ?ticker ?exchangeLabel ?dissolved WHERE {{
+        VALUES ?nct {{ {values_str} }}
+        ?trial wdt:P3098 ?nct ;
+               rdfs:label ?trialLabel .
         
-        FILTER NOT EXISTS {{ ?currentEntity wdt:P1366 ?futureReplacement. }}
-
-        ?currentEntity rdfs:label ?currentName.
-        FILTER(LANG(?currentName) = "en")
-
-        OPTIONAL {{ ?currentEntity wdt:P249 ?directTicker. }}
+        FILTER (lang(?trialLabel) = "en")
         
-        OPTIONAL {{ 
-            ?currentEntity p:P414 ?exchangeStatement. 
-            ?exchangeStatement ps:P414 ?exchange.
-            ?exchange rdfs:label ?exchangeLabel.
-            FILTER(LANG(?exchangeLabel) = "en")
-            OPTIONAL {{ ?exchangeStatement pq:P249 ?qualifierTicker. }}
+        OPTIONAL {{
+            ?trial wdt:P859 ?company .
+            OPTIONAL {{ ?company rdfs:label ?companyLabel FILTER(lang(?companyLabel) = "en") }}
+            
+            OPTIONAL {{
+                {_ENRICHMENT_PATTERN.format(entity="company")}
+            }}
         }}
-        
-        BIND(COALESCE(?directTicker, ?qualifierTicker) AS ?ticker)
-        
-        OPTIONAL {{ ?currentEntity wdt:P576 ?dissolved. }}
     }}
-    ORDER BY DESC(?ticker) ASC(?dissolved)
-    LIMIT 1
     """
     
-    rows = _run_sparql_query(query, f"Enrich-{company_qid}") or []
-    
-    if not rows:
-         # Fallback default if enrichment yields nothing
-         return {
-            "parents": set(),
-            "subsidiaries": set(),
-            "tickers": set(),
-            "exchanges": set(),
-            "countries": set(),
-            "sec_cik": None,
-            "dissolved": False
-         }
-         
-    res = rows[0]
-    # Remove debug print for production
-    # print(f" [DEBUG Enrich: {company_qid} -> {res.get('currentName', {}).get('value')} | Ticker: {res.get('ticker', {}).get('value', 'None')}] ", end="")
-    ticker = res.get('ticker', {}).get('value', "PRIVATE")
-    status = "Active"
-    if "dissolved" in res: status = "Dissolved"
-    
-    # Map back to the expected structure for existing CSV logic
-    # Note: original code expected plural sets (parents, tickers, etc).
-    # We simplified to singular best-match for stability.
-    # Main loop usage: 
-    # ticker: "; ".join(sorted(enrichment["tickers"]))
-    # exchange: ... enrichment["exchanges"]
+    rows = _run_sparql_query(query, f"ResolveBatch-{nct_ids[0]}")
+    if rows is None:
+        # Query failed: not the same as "no link", and ENRICHMENT_CACHE stays untouched
+        raise LookupUnavailable(f"identity query failed for {len(nct_ids)} trials")
     
-    result = {
-        "parents": {res.get("currentName", {}).get("value")},
-        "subsidiaries": set(),
-        "tickers": {ticker} if ticker != "PRIVATE" else set(),
-        "exchanges": {res.get("exchangeLabel", {}).get("value")} if "exchangeLabel" in res else set(),
-        "countries": set(),
-        "sec_cik": None,
-        "dissolved": "dissolved" in res
-    }
+    seen = set()
+    rows_by_company = {}
+    for row in rows:
+        nct_id = row["nct"]["value"]
+        if nct_id not in identities:
+            continue
+        company_uri = row.get("company", {}).get("value")
+        # Keep the first sponsor per trial, as the Stage 1 query does
+        if nct_id not in seen:
+            seen.add(nct_id)
+            identities[nct_id] = {
+                "nct_id": nct_id,
+                "trial_label": row.get("trialLabel", {}).get("value", "Unknown"),
+                "company_uri": company_uri,
+                "company_label": _company_label(row)
+            }
+        if company_uri:
+            company_rows = rows_by_company.setdefault(company_uri, [])
+            if "currentName" in row:
+                company_rows.append(row)
     
-    ENRICHMENT_CACHE[company_uri] = result
-    return result
+    for company_uri, company_rows in rows_by_company.items():
+        if company_rows:
+            ENRICHMENT_CACHE[company_uri] = _enrichment_from_row(_best_enrichment_row(company_rows))
+        else:
+            ENRICHMENT_CACHE[company_uri] = _empty_enrichment()
+    return identities
 
+@functools.lru_cache(maxsize=None)
 def clean_company_name(name: str) -> str:
     """
     Remove common corporate suffixes to improve matching chances.
     """
-    import re
-    # Common suffixes to remove (case insensitive)
-    suffixes = [
-        r",?\s+Inc\.?$", r",?\s+Incorporated$", 
-        r",?\s+LLC$", r",?\s+L\.L\.C\.$", 
-        r",?\s+LP$", r",?\s+L\.P\.$", 
-        r",?\s+Ltd\.?$", r",?\s+Limited$", 
-        r",?\s+Corp\.?$", r",?\s+Corporation$", 
-        r",?\s+PLC$", r",?\s+S\.A\.$", 
-        r",?\s+GmbH$", r",?\s+N\.V\.$",
-        r",?\s+B\.V\.$"
-    ]
-    
-    cleaned = name
-    for pattern in suffixes:
-        cleaned = re.sub(pattern, "", cleaned, flags=re.IGNORECASE)
-    
-    return cleaned.strip()
+    return CORPORATE_SUFFIX_RE.sub("", name).strip()
 
 def search_wikidata_candidates(name, limit=5):
     """
-    Returns list of top QIDs matching the name.
+    Returns list of top QIDs matching the name, or None if the search failed
+    or was skipped by the circuit breaker.
     """
     api_url = "https://www.wikidata.org/w/api.php"
     params = {
@@ -244,70 +602,173 @@ def search_wikidata_candidates(name, limit=5):
         'User-Agent': 'BioTechBot/1.0 (https://example.com/) PythonRequests/2.31'
     }
     
+    request_key = json.dumps(params, sort_keys=True)
+    cached = _http_cache_get(api_url, request_key)
+    if cached is not None:
+        return cached
+    
+    if not BREAKER.allow():
+        return None
+    
     try:
         resp = SESSION.get(api_url, params=params, headers=headers, timeout=10)
         resp.raise_for_status()
-        data = resp.json()
-        return [r["id"] for r in data.get("search", [])]
+        data = orjson.loads(resp.content)
+        qids = [r["id"] for r in data.get("search", [])]
+        BREAKER.reset()
+        _http_cache_put(api_url, request_key, qids)
+        return qids
     except Exception as e:
+        _record_error(e)
         print(f"Search API error for '{name}': {e}")
-        return []
+        return None
+
+def search_wikidata_candidates_bulk(search_terms, limit=5):
+    """
+    Runs entity search for several terms in one SPARQL round trip via the
+    wikibase:mwapi EntitySearch service.
+    Returns list of unique QIDs ordered by search term, then by search rank,
+    or None if the query failed (callers fall back to per-term search).
+    """
+    values_str = " ".join(
+        f"({idx} {_sparql_str(term)})" for idx, term in enumerate(search_terms)
+    )
+    query = f"""
+    PREFIX wikibase: <http://wikiba.se/ontology#>
+    PREFIX bd: <http://www.bigdata.com/rdf#>
+    PREFIX mwapi: <https://www.mediawiki.org/ontology#API/>
+
+    SELECT ?idx ?item ?ordinal WHERE {{
+        VALUES (?idx ?search) {{ {values_str} }}
+        SERVICE wikibase:mwapi {{
+            # One page of `limit` results per term instead of paging through all matches
+            bd:serviceParam wikibase:api "EntitySearch" ;
+                            wikibase:endpoint "www.wikidata.org" ;
+                            wikibase:limit "once" ;
+                            mwapi:search ?search ;
+                            mwapi:language "en" ;
+                            mwapi:limit "{limit}" .
+            ?item wikibase:apiOutputItem mwapi:item .
+            ?ordinal wikibase:apiOrdinal true .
+        }}
+    }}
+    """
+    
+    rows = _run_sparql_query(query, f"Search-{search_terms[0]}")
+    if rows is None:
+        return None
+    
+    ranked = sorted(
+        (int(row["idx"]["value"]), int(row["ordinal"]["value"]), row["item"]["value"].split('/')[-1])
+        for row in rows
+    )
+    return list(dict.fromkeys(qid for _, _, qid in ranked))
+
+def _claim_values(entity, prop):
+    """
+    Returns the non-deprecated values of a property in a wbgetentities entity.
+    Item values are reduced to their QID; other values are returned as-is.
+    """
+    values = []
+    for claim in entity.get("claims", {}).get(prop, []):
+        if claim.get("rank") == "deprecated":
+            continue
+        datavalue = claim.get("mainsnak", {}).get("datavalue")
+        if datavalue is None:
+            continue
+        value = datavalue.get("value")
+        values.append(value.get("id", value) if isinstance(value, dict) else value)
+    return values
+
+def _summarize_entity(entity):
+    """
+    Keeps only the claims used for candidate scoring, so cached entities stay small.
+    """
+    return {
+        "instance_of": _claim_values(entity, "P31"),
+        "props": [p for p in SCORED_PROPERTIES if _claim_values(entity, p)]
+    }
+
+def get_entities(qids):
+    """
+    Fetches claim summaries for QIDs via wbgetentities, WBGETENTITIES_MAX per call.
+    Returns dict { qid: {"instance_of": [...], "props": [...]} } for the entities found,
+    or None if any chunk failed or was skipped by the circuit breaker.
+    """
+    api_url = "https://www.wikidata.org/w/api.php"
+    pending = [q for q in dict.fromkeys(qids) if q not in ENTITY_CACHE]
+    failed = False
+    
+    for start in range(0, len(pending), WBGETENTITIES_MAX):
+        chunk = pending[start:start + WBGETENTITIES_MAX]
+        params = {
+            "action": "wbgetentities",
+            "ids": "|".join(chunk),
+            "props": "claims",
+            "format": "json"
+        }
+        request_key = json.dumps(params, sort_keys=True)
+        summaries = _http_cache_get(api_url, request_key)
+        if summaries is None:
+            if not BREAKER.allow():
+                failed = True
+                continue
+            try:
+                resp = SESSION.get(api_url, params=params, timeout=30)
+                resp.raise_for_status()
+                entities = orjson.loads(resp.content).get("entities", {})
+                BREAKER.reset()
+            except Exception as e:
+                _record_error(e)
+                print(f"Entity API error for {chunk}: {e}", file=sys.stderr)
+                failed = True
+                continue
+            summaries = {
+                qid: _summarize_entity(entity)
+                for qid, entity in entities.items() if "missing" not in entity
+            }
+            _http_cache_put(api_url, request_key, summaries)
+        ENTITY_CACHE.update(summaries)
+    
+    if failed:
+        return None
+    return {q: ENTITY_CACHE[q] for q in qids if q in ENTITY_CACHE}
 
 def validate_company_candidates(qids):
     """
     Given a list of QIDs, return the best one that appears to be a company/organization.
     Scores candidates based on data richness (Ticker > Parent > Historical Links > Owner).
     Also recognizes historical/merged companies via P1366 (replaced by) and P576 (dissolved).
+    Claims come from wbgetentities and are scored locally (no SPARQL).
+    Raises LookupUnavailable if the claims or the company class list could not be fetched.
     """
     if not qids:
          return None
-         
-    # Construct VALUES clause
-    values_str = " ".join([f"wd:{q}" for q in qids])
     
-    # Query to check attributes - include historical company markers
-    query = f"""
-    SELECT DISTINCT ?item ?hasTicker ?hasParent ?hasOwner ?isCompany ?wasReplaced ?wasDissolved WHERE {{
-      VALUES ?item {{ {values_str} }}
-      
-      OPTIONAL {{ ?item wdt:P249 ?ticker. BIND(1 AS ?hasTicker) }}
-      OPTIONAL {{ ?item wdt:P749 ?parent. BIND(1 AS ?hasParent) }}
-      OPTIONAL {{ ?item wdt:P127 ?owner. BIND(1 AS ?hasOwner) }}
-      OPTIONAL {{ ?item wdt:P1366 ?successor. BIND(1 AS ?wasReplaced) }}
-      OPTIONAL {{ ?item wdt:P576 ?dissolved. BIND(1 AS ?wasDissolved) }}
-      
-      # Check instance type
-      {{
-        ?item wdt:P31/wdt:P279* wd:Q43229 . BIND(1 AS ?isCompany)
-      }} UNION {{
-        ?item wdt:P31/wdt:P279* wd:Q4830453 . BIND(1 AS ?isCompany)
-      }}
-    }}
-    """
-    
-    try:
-        rows = _run_sparql_query(query, "Validation")
-    except Exception:
-        return None
-        
-    if not rows:
-        return None
+    key = tuple(qids)
+    if key in VALIDATION_CACHE:
+        return VALIDATION_CACHE[key]
+         
+    entities = get_entities(qids)
+    if entities is None:
+        # Not a real miss: leave uncached so a later call retries
+        raise LookupUnavailable(f"wbgetentities failed for {len(qids)} candidates")
         
+    classes = company_classes()
     scores = {}
-    for r in rows:
-        qid = r['item']['value'].split('/')[-1]
-        score = 0
-        if r.get('isCompany'): score += 1
-        if r.get('hasOwner'): score += 2
-        if r.get('hasParent'): score += 3
-        if r.get('wasReplaced'): score += 4  # Historical company - strong signal for resolution!
-        if r.get('wasDissolved'): score += 2  # Another historical marker
-        if r.get('hasTicker'): score += 5
-        
+    for qid, entity in entities.items():
         # Skip if not a company at all
-        if score == 0:
-             continue
-             
+        if not any(c in classes for c in entity["instance_of"]):
+            continue
+        
+        props = entity["props"]
+        score = 1
+        if "P127" in props: score += 2
+        if "P749" in props: score += 3
+        if "P1366" in props: score += 4  # Historical company - strong signal for resolution!
+        if "P576" in props: score += 2  # Another historical marker
+        if "P249" in props: score += 5
+        
         scores[qid] = score
 
     # Pick the highest scoring candidate
@@ -319,28 +780,29 @@ def validate_company_candidates(qids):
             if scores[q] > best_score:
                 best_score = scores[q]
                 best_candidate = q
-                
+    
+    VALIDATION_CACHE[key] = best_candidate
     return best_candidate
 
 def search_wikidata_id(name):
     """
     Wrapper to perform Smart Search: Get candidates -> Filter for Company.
     Tries multiple name variations to maximize match chances.
+    Raises LookupUnavailable (and memoizes nothing) if Wikidata could not be reached.
     """
-    import re
+    if name in SEARCH_ID_CACHE:
+        return SEARCH_ID_CACHE[name]
     
+    qid = _search_wikidata_id(name)
+    SEARCH_ID_CACHE[name] = qid
+    return qid
+
+def _search_wikidata_id(name):
     # Create search variations
     variations = [name]
     
     # Strip common pharma suffixes to get base name
-    suffixes_to_strip = [
-        r"\s+Pharmaceuticals?$", r"\s+Biotech$", r"\s+Therapeutics$",
-        r"\s+Biosciences$", r"\s+Company$", r"\s+Sciences$",
-        r",?\s+Inc\.?$", r",?\s+LLC$", r",?\s+LP$", r",?\s+Ltd\.?$"
-    ]
-    stripped = name
-    for pattern in suffixes_to_strip:
-        stripped = re.sub(pattern, "", stripped, flags=re.IGNORECASE).strip()
+    stripped = SEARCH_SUFFIX_RE.sub("", name).strip()
     if stripped != name and stripped:
         variations.append(stripped)
     
@@ -358,15 +820,20 @@ def search_wikidata_id(name):
             if suffix.lower() not in name.lower():
                 variations.append(name + suffix)
     
-    all_candidates = []
-    seen = set()
-    
-    for search_term in variations:
-        candidates = search_wikidata_candidates(search_term)
-        for q in candidates:
-            if q not in seen:
-                all_candidates.append(q)
-                seen.add(q)
+    # One federated search for every variation; per-variation API calls only if it fails
+    all_candidates = search_wikidata_candidates_bulk(variations)
+    if all_candidates is None:
+        all_candidates = []
+        seen = set()
+        
+        for search_term in variations:
+            candidates = search_wikidata_candidates(search_term)
+            if candidates is None:
+                raise LookupUnavailable(f"search failed for '{search_term}'")
+            for q in candidates:
+                if q not in seen:
+                    all_candidates.append(q)
+                    seen.add(q)
                 
     if all_candidates:
         return validate_company_candidates(all_candidates)
@@ -376,6 +843,8 @@ def search_wikidata_id(name):
 def find_company_by_name(name: str):
     """
     Stage 1.5: Fallback Identity Query using API Search.
+    Returns the company URI or None for no match. Raises LookupUnavailable when the
+    search could not complete, so outages are not memoized as "no match".
     """
     # 1. Try search with cleaning (advanced fallback handled inside search_wikidata_id)
     # We use the cached results if available.
@@ -397,109 +866,312 @@ def find_company_by_name(name: str):
     COMPANY_URI_CACHE[name] = None
     return None
 
+def _sparql_str(value: str) -> str:
+    """
+    Escapes a Python string for use as a quoted SPARQL literal.
+    """
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return '"' + escaped.replace("\n", "\\n").replace("\r", "\\r") + '"'
+
+def find_companies_by_names(names, batch_size=64):
+    """
+    Batched Stage 1.5: matches many sponsor names against English labels/aliases
+    in one SPARQL query per batch (VALUES block) instead of one lookup per name.
+    Returns dict { name: uri } for matched names and seeds COMPANY_URI_CACHE.
+    Unmatched names are left out so find_company_by_name can run the search fallback.
+    """
+    matches = {}
+    pending = [n for n in dict.fromkeys(names) if n not in COMPANY_URI_CACHE]
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+
+        # Try the raw name plus cleaned/title-cased variants (OpenFDA names are upper case)
+        pairs = []
+        for name in chunk:
+            clean = clean_company_name(name)
+            for variant in dict.fromkeys([name, clean, clean.title()]):
+                if variant:
+                    pairs.append(f"({_sparql_str(name)} {_sparql_str(variant)}@en)")
+        values_str = " ".join(pairs)
+
+        query = f"""
+        PREFIX wd: <http://www.wikidata.org/entity/>
+        PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+        PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+        PREFIX skos: <http://www.w3.org/2004/02/skos/core#>
+
+        SELECT DISTINCT ?name ?company ?ticker WHERE {{
+            VALUES (?name ?label) {{ {values_str} }}
+            ?company rdfs:label|skos:altLabel ?label .
+            ?company wdt:P31/wdt:P279* wd:Q4830453 .
+            OPTIONAL {{ ?company wdt:P249 ?ticker . }}
+        }}
+        """
+
+        rows = _run_sparql_query(query, f"BatchName-{start // batch_size}") or []
+
+        # Prefer listed companies when a label is ambiguous
+        for r in sorted(rows, key=lambda r: "ticker" not in r):
+            name = r["name"]["value"]
+            if name not in matches:
+                matches[name] = r["company"]["value"]
+
+    COMPANY_URI_CACHE.update(matches)
+    return matches
+
 def load_industry_sponsors(filepath: str):
     """
-    Reads the pipe-delimited sponsors file and returns a list of dicts 
+    Lazily reads the pipe-delimited sponsors file, yielding dicts 
     {'nct_id': str, 'name': str} where the agency_class is 'INDUSTRY'.
+    Records are yielded in file order.
     """
-    sponsors = []
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f, delimiter='|')
+            # Plain csv.reader with column indexes: no per-row dict is built,
+            # and only INDUSTRY rows are turned into records
+            reader = csv.reader(f, delimiter='|')
+            header = next(reader, [])
+            nct_idx = header.index('nct_id')
+            class_idx = header.index('agency_class')
+            name_idx = header.index('name')
+            width = max(nct_idx, class_idx, name_idx)
             for row in reader:
-                if row.get('agency_class') == 'INDUSTRY':
-                    nct = row.get('nct_id')
-                    name = row.get('name')
+                if len(row) > width and row[class_idx] == 'INDUSTRY':
+                    nct = row[nct_idx]
+                    name = row[name_idx]
                     if nct and name:
-                        sponsors.append({'nct_id': nct, 'name': name})
+                        yield {'nct_id': nct, 'name': name}
     except FileNotFoundError:
         print(f"Error: File not found at {filepath}", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
         print(f"Error reading {filepath}: {e}", file=sys.stderr)
         sys.exit(1)
+
+def prepare_resume(output_path: str):
+    """
+    Readies an interrupted run's output CSV for --resume and returns the NCT IDs
+    already written. The file is cut back to its last complete line, and the rows of
+    its last trial are dropped too (a kill mid-write can leave a trial partly written),
+    so that trial is resolved again and appended rows never merge into a partial one.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        lines = data[:data.rfind(b'\n') + 1].splitlines(keepends=True)
+        keep = len(lines)
+        if keep > 1:
+            # nct_id is the first column and never needs quoting
+            last_nct = lines[-1].split(b',', 1)[0]
+            while keep > 1 and lines[keep - 1].split(b',', 1)[0] == last_nct:
+                keep -= 1
+        f.truncate(sum(len(line) for line in lines[:keep]))
+    return {line.split(b',', 1)[0].decode('utf-8') for line in lines[1:keep]}
+
+def format_record_row(record, company_uri, company_label, enrichment):
+    """
+    Builds the output CSV row for a trial record from its resolved company and
+    Stage 2 enrichment. Returns (row, note) where note is a short progress message.
+    """
+    nct_id = record['nct_id']
     
-    # Sort by NCT ID
-    sponsors.sort(key=lambda x: x['nct_id'])
-    return sponsors
+    if not company_uri:
+        return {
+            "nct_id": nct_id,
+            "company": record['name'],
+            "ticker": "N/A", 
+            "exchange": "N/A", 
+            "status": "N/A",
+            "wikidata_uri": ""
+        }, "No match."
+    
+    status = "Active"
+    if enrichment.get("dissolved"): status = "Inactive"
+
+    row = {
+        "nct_id": nct_id,
+        "company": company_label,
+        "ticker": "; ".join(sorted(enrichment["tickers"])) if enrichment["tickers"] else "Private/Unlisted",
+        "exchange": "; ".join(sorted(enrichment["exchanges"])) if enrichment["exchanges"] else "N/A",
+        "status": status,
+        "wikidata_uri": company_uri
+    }
+    return row, f"[URI: {company_uri.split('/')[-1]}] Done."
+
+def _try_find_company_by_name(name):
+    """
+    find_company_by_name for worker threads: returns (uri, failed) instead of raising.
+    """
+    try:
+        return find_company_by_name(name), False
+    except LookupUnavailable as e:
+        print(f"Lookup unavailable for '{name}': {e}", file=sys.stderr)
+        return None, True
+
+def iter_record_chunks(records, size):
+    """
+    Groups records into lists of about `size`, never splitting a trial's consecutive
+    sponsor rows across two chunks (resolve_records counts sponsor rows per trial).
+    """
+    chunk = []
+    for record in records:
+        if len(chunk) >= size and record['nct_id'] != chunk[-1]['nct_id']:
+            yield chunk
+            chunk = []
+        chunk.append(record)
+    if chunk:
+        yield chunk
+
+def _cached_link_identity(record):
+    """
+    Stage 1 identity for a trial record built from its sponsor name's SPONSOR_LINK_CACHE entry.
+    """
+    company_uri, company_label = SPONSOR_LINK_CACHE[record['name']]
+    return {
+        "nct_id": record['nct_id'], "trial_label": "Unknown",
+        "company_uri": company_uri, "company_label": company_label
+    }
+
+def resolve_records(sponsor_records, workers=RESOLVE_WORKERS):
+    """
+    Resolves a batch of trial records through Stage 1 (batched), Stage 1.5 (concurrent,
+    once per unique name) and Stage 2 (batched). Returns [(row, note)] in input order;
+    row is None for every record of a trial where any lookup failed, so the trial is
+    not written at all and a --resume run (which skips by NCT ID) retries it whole.
+    """
+    # Collaborators are INDUSTRY rows too, so only single-sponsor trials can reuse or
+    # populate the name -> company link cache
+    rows_per_trial = Counter(r['nct_id'] for r in sponsor_records)
+
+    # Stage 1 (fused with Stage 2 enrichment): IDENTITY_BATCH_SIZE NCT IDs per query,
+    # skipping trials whose sponsor name an earlier trial already linked to a Wikidata company
+    identities = {}
+    stage1_failed = set()
+    for record in sponsor_records:
+        if rows_per_trial[record['nct_id']] == 1 and record['name'] in SPONSOR_LINK_CACHE:
+            identities[record['nct_id']] = _cached_link_identity(record)
+    records_iter = (r for r in sponsor_records if r['nct_id'] not in identities)
+    while True:
+        batch = list(islice(records_iter, IDENTITY_BATCH_SIZE))
+        if not batch:
+            break
+        batch_ids = [r['nct_id'] for r in batch]
+        try:
+            batch_identities = resolve_trials_batch(batch_ids)
+        except LookupUnavailable as e:
+            # These trials are marked failed below rather than sent to name search
+            print(f"Lookup unavailable for trials {batch_ids[0]}..: {e}", file=sys.stderr)
+            stage1_failed.update(batch_ids)
+            batch_identities = {nct_id: _unknown_identity(nct_id) for nct_id in batch_ids}
+        identities.update(batch_identities)
+        for record in batch:
+            identity = batch_identities[record['nct_id']]
+            if identity["company_uri"] and rows_per_trial[record['nct_id']] == 1:
+                SPONSOR_LINK_CACHE.setdefault(record['name'], (identity["company_uri"], identity["company_label"]))
+
+    # Unlinked single-sponsor trials reuse a link found for the same name by any trial
+    # in this chunk, so the outcome doesn't depend on batch or chunk position
+    for record in sponsor_records:
+        if (not identities[record['nct_id']]["company_uri"] and record['nct_id'] not in stage1_failed
+                and rows_per_trial[record['nct_id']] == 1 and record['name'] in SPONSOR_LINK_CACHE):
+            identities[record['nct_id']] = _cached_link_identity(record)
+    linked = sum(1 for identity in identities.values() if identity["company_uri"])
+    print(f"Linked {linked}/{len(identities)} trials to a sponsor via Wikidata.")
+
+    # Stage 1.5: name search for unlinked trials, once per unique sponsor name
+    # (many trials share a sponsor); lookups overlap across workers
+    unlinked_names = list(dict.fromkeys(
+        r['name'] for r in sponsor_records
+        if not identities[r['nct_id']]["company_uri"] and r['nct_id'] not in stage1_failed
+    ))
+    print(f"Searching {len(unlinked_names)} unique sponsor names...")
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        name_to_uri = dict(zip(unlinked_names, ex.map(_try_find_company_by_name, unlinked_names)))
+
+    # Fan the per-name results back out to every trial
+    companies = []
+    for record in sponsor_records:
+        identity = identities[record['nct_id']]
+        if record['nct_id'] in stage1_failed:
+            companies.append((None, record['name'], True))
+        elif identity["company_uri"]:
+            companies.append((identity["company_uri"], identity["company_label"], False)) # Prefer Wikidata label if linked
+        else:
+            company_uri, failed = name_to_uri[record['name']]
+            companies.append((company_uri, record['name'], failed))
+
+    # Stage 2: enrich every unique company URI in batched queries
+    uri_to_label = {uri: label for uri, label, _ in companies if uri}
+    print(f"Enriching {len(uri_to_label)} companies...")
+    enrichments = enrich_companies_bulk(uri_to_label, batch_size=ENRICH_BATCH_SIZE)
+
+    failed_trials = {
+        record['nct_id']
+        for record, (company_uri, _, failed) in zip(sponsor_records, companies)
+        if failed or (company_uri and company_uri not in enrichments)
+    }
+
+    results = []
+    for record, (company_uri, company_label, failed) in zip(sponsor_records, companies):
+        if record['nct_id'] in failed_trials:
+            results.append((None, "Wikidata lookup failed for this trial; not written (rerun with --resume to retry)."))
+        else:
+            results.append(format_record_row(record, company_uri, company_label, enrichments[company_uri] if company_uri else None))
+    return results
 
 def main():
     parser = argparse.ArgumentParser(description="Resolve industry sponsors from clinical trials via Wikidata.")
     parser.add_argument("--sponsors-file", default="data/sponsors.txt", help="Path to the AAAT sponsors.txt file")
     parser.add_argument("--limit", type=int, help="Limit the number of NCT IDs to process")
     parser.add_argument("--output", default="sponsors_resolved.csv", help="Output CSV filename")
+    parser.add_argument("--workers", type=int, default=RESOLVE_WORKERS, help="Concurrent Wikidata lookups")
+    parser.add_argument("--resume", action="store_true", help="Append to an existing output, skipping NCT IDs already in it")
     
     args = parser.parse_args()
 
-    print(f"Loading industry sponsors from {args.sponsors_file}...")
-    sponsor_records = load_industry_sponsors(args.sponsors_file)
-    print(f"Found {len(sponsor_records)} unique industry-sponsored trials.")
+    completed = prepare_resume(args.output) if args.resume else set()
+    if completed:
+        print(f"Resuming: skipping {len(completed)} trials already in {args.output}.")
+
+    print(f"Streaming industry sponsors from {args.sponsors_file}...")
+    sponsor_records = (r for r in load_industry_sponsors(args.sponsors_file) if r['nct_id'] not in completed)
 
     if args.limit:
         print(f"Limiting to first {args.limit} IDs.")
-        sponsor_records = sponsor_records[:args.limit]
-
-    print(f"Processing {len(sponsor_records)} trials...")
+        sponsor_records = islice(sponsor_records, args.limit)
 
     # Output fieldnames
     fieldnames = ["nct_id", "company", "ticker", "exchange", "status", "wikidata_uri"]
 
-    with open(args.output, 'w', newline='', encoding='utf-8') as csvfile:
+    processed = 0
+    failed = 0
+    with open(args.output, 'a' if completed else 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        for i, record in enumerate(sponsor_records):
-            nct_id = record['nct_id']
-            sponsor_name = record['name']
-            
-            print(f"[{i+1}/{len(sponsor_records)}] Resolving {nct_id} ({sponsor_name})...", end="", flush=True)
-            
-            company_uri = None
-            company_label = sponsor_name
-
-            # Stage 1: Try Identity via NCT Link
-            identity = get_trial_primary_sponsor(nct_id)
-            if identity["company_uri"]:
-                company_uri = identity["company_uri"]
-                company_label = identity["company_label"] # Prefer Wikidata label if linked
-            else:
-                # Stage 1.5: Fallback to Name Search
-                # print(" (Linking via name)...", end="", flush=True)
-                company_uri = find_company_by_name(sponsor_name)
-            
-            if company_uri:
-                print(f" [URI: {company_uri.split('/')[-1]}]", end="")
-            
-            if not company_uri:
-                print(" No match.")
-                writer.writerow({
-                    "nct_id": nct_id,
-                    "company": sponsor_name,
-                    "ticker": "N/A", 
-                    "exchange": "N/A", 
-                    "status": "N/A",
-                    "wikidata_uri": ""
-                })
-                continue
+        if not completed:
+            writer.writeheader()
 
-            # Stage 2: Enrichment
-            enrichment = enrich_company_content(company_uri, company_label)
-            
-            status = "Active"
-            if enrichment.get("dissolved"): status = "Inactive"
-
-            row = {
-                "nct_id": nct_id,
-                "company": company_label,
-                "ticker": "; ".join(sorted(enrichment["tickers"])) if enrichment["tickers"] else "Private/Unlisted",
-                "exchange": "; ".join(sorted(enrichment["exchanges"])) if enrichment["exchanges"] else "N/A",
-                "status": status,
-                "wikidata_uri": company_uri
-            }
-            writer.writerow(row)
-            print(" Done.")
+        # Work through the file in chunks so memory stays bounded and finished
+        # chunks are on disk if the run is interrupted. Each chunk is written with a
+        # single write, so a kill can only leave the chunk's tail partly on disk.
+        for chunk in iter_record_chunks(sponsor_records, RECORD_CHUNK_SIZE):
+            print(f"Processing trials {processed + 1}-{processed + len(chunk)}...")
+            chunk_buffer = io.StringIO()
+            chunk_writer = csv.DictWriter(chunk_buffer, fieldnames=fieldnames)
+            for record, (row, note) in zip(chunk, resolve_records(chunk, args.workers)):
+                processed += 1
+                print(f"[{processed}] {record['nct_id']} ({record['name']}) {note}")
+                if row is None:
+                    failed += 1
+                    continue
+                chunk_writer.writerow(row)
+            csvfile.write(chunk_buffer.getvalue())
+            csvfile.flush()
 
-    print(f"\nResults saved to {args.output}")
+    print(f"\nProcessed {processed} trials. Results saved to {args.output}")
+    if failed:
+        print(f"{failed} sponsor rows were not written because Wikidata lookups failed; rerun with --resume to retry them.")
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file